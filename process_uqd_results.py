@@ -10,36 +10,269 @@ Usage:
     python process_uqd_results.py saved_data/2025-07-02-035725_my_table_run "Pattern 01[counts]"
 """
 
+import os
 import sys
 from pathlib import Path
 import csv
+import functools
+import itertools
+import json
+import math
+import re
+from concurrent.futures import ProcessPoolExecutor
 
-def average_column_in_file(filepath, column_name):
-    """Return average of column_name (as float) in given CSV file."""
+try:
+    import pandas as pd
+except ImportError:  # pandas is optional; fall back to the csv module
+    pd = None
+
+try:
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; without it only the CSVs are read
+    pa_csv = pq = None
+
+# Row index of the header in UQD exports (line 3); checked first, searched if wrong
+UQD_HEADER_LINE = 2
+# How many leading bytes to probe for the header row (UQD puts it on line 3)
+HEADER_SCAN_BYTES = 16 * 1024
+# Large read buffer so each combo file is pulled in with few syscalls
+READ_BUFFER_SIZE = 1 << 20
+# Sidecar file (inside the data folder) remembering averages of unchanged files
+AVG_CACHE_NAME = ".avg_cache.json"
+# Upper bound on pool size (ProcessPoolExecutor's limit on Windows)
+MAX_POOL_WORKERS = 61
+
+@functools.lru_cache(maxsize=None)
+def _header_pattern(column_name):
+    """Compiled bytes regex matching any line that mentions column_name."""
+    return re.compile(rb"(?m)^.*" + re.escape(column_name.encode()) + rb".*$")
+
+def _row_at(filepath, index):
+    """Return the CSV row at 0-based line index of filepath ([] past the end)."""
     with open(filepath, newline='') as f:
+        return next(csv.reader(itertools.islice(f, index, index + 1)), [])
+
+def _find_header_row(filepath, column_name, header_line=None, max_bytes=HEADER_SCAN_BYTES):
+    """
+    Return the 0-based index of the first row containing column_name, or None.
+    If header_line is given, that row is checked first and no search is done
+    when it matches.
+    """
+    if header_line is not None and column_name in _row_at(filepath, header_line):
+        return header_line
+    with open(filepath, "rb") as f:
+        head = f.read(max_bytes)
+    target = column_name.encode()
+    for match in _header_pattern(column_name).finditer(head):
+        # The regex also hits lines where the name is only part of a field
+        fields = [field.strip(b'\r"') for field in match.group().split(b",")]
+        if target in fields:
+            return head.count(b"\n", 0, match.start())
+    return None
+
+def _average_column_pandas(filepath, column_name, header_line=None):
+    """Vectorized average of column_name using pandas' C parser."""
+    skiprows = _find_header_row(filepath, column_name, header_line)
+    if skiprows is None:
+        raise ValueError(f"Column {column_name} not found in {filepath}")
+    # index_col=False: rows with a trailing comma must not shift columns into the index
+    df = pd.read_csv(filepath, skiprows=skiprows, usecols=[column_name],
+                     index_col=False, engine="c")
+    values = pd.to_numeric(df[column_name], errors="coerce").dropna()
+    if values.empty:
+        raise ValueError(f"No values found for column {column_name} in {filepath}")
+    return float(values.mean())
+
+def parquet_path(csv_path):
+    """Path of the Parquet copy kept next to a UQD CSV."""
+    return Path(csv_path).with_suffix(".parquet")
+
+def write_parquet_copy(csv_path, header_line=UQD_HEADER_LINE):
+    """
+    Save a Parquet copy of a UQD CSV next to it, so later averages (of any
+    column) read typed columnar data instead of parsing text. Requires pyarrow.
+    Raises ValueError (and writes nothing) if any row has the wrong number of
+    fields, since dropping it would make the averages differ from the CSV's.
+    """
+    table = pa_csv.read_csv(csv_path, read_options=pa_csv.ReadOptions(skip_rows=header_line))
+    pq.write_table(table, parquet_path(csv_path))
+
+def _average_column_parquet(filepath, column_name):
+    """Average of column_name read from the Parquet copy of filepath."""
+    path = parquet_path(filepath)
+    if os.stat(path).st_mtime_ns < os.stat(filepath).st_mtime_ns:
+        raise ValueError(f"{path.name} is older than {Path(filepath).name}")
+    values = pq.read_table(path, columns=[column_name]).column(0).drop_null().to_numpy()
+    if values.dtype.kind not in "iuf":
+        # Non-numeric rows made pyarrow infer text: let the CSV parsers handle it
+        raise ValueError(f"Column {column_name} in {path.name} is not numeric")
+    if not values.size:
+        raise ValueError(f"No values found for column {column_name} in {path}")
+    return float(values.mean())
+
+def average_column_in_file(filepath, column_name, header_line=UQD_HEADER_LINE):
+    """
+    Return average of column_name (as float) in given CSV file.
+    header_line is the expected 0-based row of the header; if that row does
+    not hold column_name (or header_line is None) the header is searched for.
+    An up-to-date Parquet copy of the file (see write_parquet_copy) is preferred.
+    """
+    if pq is not None and parquet_path(filepath).is_file():
+        try:
+            return _average_column_parquet(filepath, column_name)
+        except ValueError:
+            pass
+    if pd is not None:
+        try:
+            return _average_column_pandas(filepath, column_name, header_line)
+        except ValueError:
+            # Header beyond the probe window or a malformed file: use the slow path
+            pass
+    return _average_column_csv(filepath, column_name, header_line)
+
+def _column_floats(rows, col_idx):
+    """
+    Yield the values of column col_idx that parse as floats, skipping the rest.
+    NaN cells are skipped too, as pandas and pyarrow treat them like empty cells.
+    """
+    for row in rows:
+        if len(row) <= col_idx:
+            continue
+        try:
+            val = float(row[col_idx])
+        except ValueError:
+            continue
+        if not math.isnan(val):
+            yield val
+
+def _average_column_csv(filepath, column_name, header_line=None):
+    """Row-by-row average of column_name using the csv module (single pass)."""
+    with open(filepath, "r", buffering=READ_BUFFER_SIZE, newline='') as f:
         reader = csv.reader(f)
-        # Skip until we find the header (usually line 3)
+        if header_line is not None:
+            leading = list(itertools.islice(reader, header_line + 1))
+            if leading and column_name in leading[-1]:
+                # Header is where expected: go straight to the data rows
+                reader = itertools.chain([leading[-1]], reader)
+            else:
+                reader = itertools.chain(leading, reader)
+        # Skip until we find the header (usually line 3); the data loop below
+        # continues on the same reader, so the file is still read only once.
         for row in reader:
             if column_name in row:
-                header = row
+                col_idx = row.index(column_name)
                 break
         else:
             raise ValueError(f"Column {column_name} not found in {filepath}")
 
-        col_idx = header.index(column_name)
-        # Now, read rows of data
-        values = []
-        for row in reader:
-            if len(row) <= col_idx:
-                continue
-            try:
-                val = float(row[col_idx])
-                values.append(val)
-            except ValueError:
-                continue
-        if not values:
-            raise ValueError(f"No values found for column {column_name} in {filepath}")
-        return sum(values) / len(values)
+        # Running total: no list of values is built
+        total = 0.0
+        count = 0
+        for val in _column_floats(reader, col_idx):
+            total += val
+            count += 1
+    if not count:
+        raise ValueError(f"No values found for column {column_name} in {filepath}")
+    return total / count
+
+def _safe_avg(filepath, column_name):
+    """Worker for average_files: return (filename, average or the raised exception)."""
+    try:
+        return Path(filepath).name, average_column_in_file(filepath, column_name)
+    except Exception as e:
+        return Path(filepath).name, e
+
+def list_csv_files(data_folder, prefix="", exclude=frozenset()):
+    """
+    Return the sorted paths (as strings) of prefix*.csv files in data_folder.
+
+    Uses os.scandir so no Path objects or extra stat calls are needed per file.
+    """
+    with os.scandir(data_folder) as entries:
+        return sorted(
+            entry.path for entry in entries
+            if entry.name.startswith(prefix) and entry.name.endswith(".csv")
+            and entry.name not in exclude and entry.is_file()
+        )
+
+def _avg_cache_key(filepath, column_name):
+    """Cache key for a file's average; changes whenever the file is rewritten."""
+    st = os.stat(filepath)
+    return json.dumps([Path(filepath).name, st.st_mtime_ns, st.st_size, column_name])
+
+def _load_avg_cache(cache_file):
+    """Return the cached averages stored in cache_file, or {} if missing/unreadable."""
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def average_files(files, column_name, max_workers=None, chunksize=8, cache_file=None):
+    """
+    Average column_name in each file using a pool of worker processes.
+
+    If cache_file is given, averages of files unchanged since the last run
+    (same name, mtime and size) are taken from it and only the rest are parsed.
+
+    Returns a list of (filename, average_or_exception) in the order of files.
+    """
+    cache = _load_avg_cache(cache_file) if cache_file else {}
+    results = [None] * len(files)
+    misses = []
+    for idx, f in enumerate(files):
+        try:
+            key = _avg_cache_key(f, column_name)
+        except OSError as e:
+            # Missing/unreadable file: report it like any other failed average
+            results[idx] = (Path(f).name, e)
+            continue
+        if key in cache:
+            results[idx] = (Path(f).name, cache[key])
+        else:
+            misses.append((idx, f, key))
+
+    if misses:
+        worker = functools.partial(_safe_avg, column_name=column_name)
+        to_parse = [f for _, f, _ in misses]
+        # No more workers than files; Windows caps a pool at 61 processes
+        n_workers = min(len(misses), max_workers or os.cpu_count() or 1, MAX_POOL_WORKERS)
+        if n_workers == 1:
+            # Starting a process (which re-imports the entry script) isn't worth it
+            averages = list(map(worker, to_parse))
+        else:
+            # Keep chunks small enough that every worker gets some files
+            chunksize = max(1, min(chunksize, len(to_parse) // n_workers))
+            with ProcessPoolExecutor(max_workers=n_workers) as ex:
+                averages = list(ex.map(worker, to_parse, chunksize=chunksize))
+        for (idx, _, key), (name, avg) in zip(misses, averages):
+            results[idx] = (name, avg)
+            if not isinstance(avg, Exception):
+                cache[key] = avg
+        if cache_file:
+            with open(cache_file, "w") as f:
+                json.dump(cache, f)
+
+    return results
+
+def write_summary(output_path, column_name, results):
+    """
+    Write the (filename, average) rows of results to output_path.
+    Entries whose average is an exception are reported and left out.
+    """
+    rows = []
+    for name, avg in results:
+        if isinstance(avg, Exception):
+            print(f"Warning: {name}: {avg}")
+            continue
+        print(f"{name}: {avg}")
+        rows.append([name, avg])
+
+    with open(output_path, "w", newline='') as outcsv:
+        writer = csv.writer(outcsv)
+        writer.writerow(["filename", f"avg_{column_name}"])
+        writer.writerows(rows)
 
 def main():
     if len(sys.argv) != 3:
@@ -53,24 +286,18 @@ def main():
         print(f"Error: {data_folder} is not a valid folder.")
         sys.exit(1)
 
-    combo_files = sorted(data_folder.glob("combo*.csv"))
+    output_file = data_folder / "combo_averages.csv"
+    combo_files = list_csv_files(data_folder, prefix="combo", exclude={output_file.name})
     if not combo_files:
         print(f"No combo*.csv files found in {data_folder}")
         sys.exit(1)
 
-    output_file = data_folder / "combo_averages.csv"
     print(f"Processing {len(combo_files)} files...")
 
-    with open(output_file, "w", newline='') as outcsv:
-        writer = csv.writer(outcsv)
-        writer.writerow(["filename", f"avg_{column_name}"])
-        for csv_file in combo_files:
-            try:
-                avg = average_column_in_file(csv_file, column_name)
-                print(f"{csv_file.name}: {avg}")
-                writer.writerow([csv_file.name, avg])
-            except Exception as e:
-                print(f"Warning: {csv_file.name}: {e}")
+    results = average_files(combo_files, column_name,
+                            cache_file=data_folder / AVG_CACHE_NAME)
+
+    write_summary(output_file, column_name, results)
 
     print(f"\nSummary written to: {output_file}")
 
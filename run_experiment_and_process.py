@@ -15,16 +15,37 @@ import sys
 sys.path.insert(0, str(Path(__file__).parent / "newportxps_control"))
 
 # Import experiment's routines (must be in the same folder or PYTHONPATH)
-from two_qubit_tomography_xps import measurement
+from two_qubit_tomography_xps import measurement, load_manifest, SAVED_DATA_DIR
 from newportxpslib.xps_session import XPSMotionSession
 
-# Import the averaging helper from your processing code.
-from process_uqd_results import average_column_in_file  
+# Import the averaging and summary helpers from your processing code.
+from process_uqd_results import (
+    average_files, list_csv_files, write_summary, AVG_CACHE_NAME)
+
+# Summary/output files (which should not be included in the averages)
+SUMMARY_FILES = {"total_averages.csv", "position_report.csv"}
+
+def process_files(files, column_name, output_path):
+    """
+    Compute the average of the specified column for each of the given CSV files
+    and write results to output_path (no directory scan involved).
+
+    Args:
+        files: Result CSVs to process.
+        column_name: The CSV column to average (as string).
+        output_path: Output CSV for averages.
+    """
+    output_path = Path(output_path)
+    # Files are independent, so average them in parallel worker processes
+    results = average_files([str(f) for f in files], column_name,
+                            cache_file=output_path.parent / AVG_CACHE_NAME)
+    write_summary(output_path, column_name, results)
 
 def process_all_combos(data_folder, column_name, output_file="total_averages.csv"):
     """
     Process all *.csv files in data_folder (excluding summary files),
     compute the average for the specified column, and write results to output_file.
+    If the folder has a manifest from `measurement`, only the files it lists are used.
 
     Args:
         data_folder: Path to the folder containing result CSVs.
@@ -32,24 +53,14 @@ def process_all_combos(data_folder, column_name, output_file="total_averages.csv
         output_file: Output CSV for averages (default: total_averages.csv).
     """
     data_folder = Path(data_folder)
-    all_files = sorted(Path(data_folder).glob("*.csv"))
-    # Exclude summary/output files (which should not be included in the averages)
-    csv_files = [f for f in all_files if f.name not in ["total_averages.csv", "position_report.csv"]]
-    
+    csv_files = load_manifest(data_folder)
+    if csv_files is None:
+        csv_files = list_csv_files(data_folder, exclude=SUMMARY_FILES)
+
     if not csv_files:
         print(f"No .csv files found in {data_folder}")
         return
-    with open(Path(data_folder) / output_file, "w", newline="") as outcsv:
-        import csv
-        writer = csv.writer(outcsv)
-        writer.writerow(["filename", f"avg_{column_name}"])
-        for csv_file in csv_files:
-            try:
-                avg = average_column_in_file(csv_file, column_name)
-                print(f"{csv_file.name}: {avg}")
-                writer.writerow([csv_file.name, avg])
-            except Exception as e:
-                print(f"Warning: {csv_file.name}: {e}")
+    process_files(csv_files, column_name, data_folder / output_file)
 
 def main():
     """
@@ -84,7 +95,7 @@ def main():
     # --- 1. Run the XPS measurement routine
     session = XPSMotionSession(stages=stages, verbose=True)
 
-    measurement(
+    data_dir, written_files = measurement(
         session,
         args.motion,
         args.wait,
@@ -92,11 +103,12 @@ def main():
     )
     session.close() # Always close the session to release the connection!
 
-    # --- 2. Determine which folder to process (the latest with the given description)
-    data_root = Path(__file__).parent / "saved_data"
+    # --- 2. Determine which folder to process (this run's, unless overridden)
+    data_root = SAVED_DATA_DIR
     if args.folder:
         data_dir = Path(args.folder)
-    else:
+        written_files = None
+    elif data_dir is None:
         # Find the most recent folder with the description
         # (If not specified, finds the most recent output folder with the given description.)
         matching = sorted(data_root.glob(f"*_{args.desc}"), 
@@ -110,7 +122,11 @@ def main():
 
     # --- 3. Run postprocessing if requested
     if args.process:
-        process_all_combos(data_dir, args.column)
+        if written_files:
+            # Measurement already knows which files it wrote: no folder scan needed
+            process_files(written_files, args.column, data_dir / "total_averages.csv")
+        else:
+            process_all_combos(data_dir, args.column)
         print(f"Results written to {data_dir}/total_averages.csv")
     else:
         print("Measurement done. (Use --process to postprocess averages.)")
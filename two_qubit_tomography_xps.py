@@ -13,18 +13,29 @@ Place screenshots (e.g., csv_file_tag.png, save_file_dialog.png, etc.) in a 'scr
 and run from your project root.
 """
 
+import json
 import sys
 from pathlib import Path
 
+# Project folders, resolved once
+MODULE_DIR = Path(__file__).resolve().parent
+SAVED_DATA_DIR = MODULE_DIR / "saved_data"
+SCREENSHOTS_DIR = MODULE_DIR / "screenshots"
+
 # Make the nested newportxpslib folder importable as top-level 'newportxpslib'
-sys.path.insert(0, str(Path(__file__).parent / "newportxps_control"))
+sys.path.insert(0, str(MODULE_DIR / "newportxps_control"))
 
+import cv2
+import numpy as np
 import pyautogui as pag
 import pygetwindow as gw
+import pyperclip
 from pathlib import Path
 from time import sleep, time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
+import process_uqd_results
 from newportxpslib.xps_session import XPSMotionSession
 from newportxpslib.controller_interface import initialize_groups, home_groups
 from newportxpslib.xps_config import load_full_config, load_user_credentials
@@ -34,6 +45,90 @@ from newportxpslib.xps_config import load_full_config, load_user_credentials
 class MouseInterferenceError(Exception):
     pass
 
+# -------------------------------
+# Template matching helpers
+# Decoded screenshot templates, keyed by path (each PNG is read from disk once)
+_TEMPLATES = {}
+# Padded search region around the last match of each template
+_LAST_REGIONS = {}
+# Margin (pixels) added around a previous match when searching near it again
+REGION_MARGIN = 50
+
+def load_template(image_path):
+    """Return the decoded template for image_path, reading it from disk only once."""
+    key = str(image_path)
+    img = _TEMPLATES.get(key)
+    if img is None:
+        img = cv2.imread(key)
+        if img is None:
+            raise FileNotFoundError(f"Could not read image file: {image_path}")
+        _TEMPLATES[key] = img
+    return img
+
+def preload_templates(image_paths):
+    """
+    Decode all templates up front (in parallel threads; cv2 releases the GIL)
+    and warm up pyautogui's screen backend, so the first locate is not slower
+    than the rest.
+    """
+    with ThreadPoolExecutor() as ex:
+        list(ex.map(load_template, image_paths))
+    pag.size()
+
+def _grab_screen():
+    """Take one screenshot as a BGR array (the same layout cv2.imread gives)."""
+    return cv2.cvtColor(np.array(pag.screenshot()), cv2.COLOR_RGB2BGR)
+
+def _match(screen, needle, confidence, region=None):
+    """
+    Best match of needle in screen (optionally only inside region), as a
+    (left, top, width, height) box in screen coordinates, or None.
+    """
+    x0, y0 = 0, 0
+    if region:
+        x0, y0, w, h = region
+        screen = screen[y0:y0 + h, x0:x0 + w]
+    height, width = needle.shape[:2]
+    if screen.shape[0] < height or screen.shape[1] < width:
+        return None
+    scores = cv2.matchTemplate(screen, needle, cv2.TM_CCOEFF_NORMED)
+    _, best, _, (left, top) = cv2.minMaxLoc(scores)
+    if best < confidence:
+        return None
+    return (x0 + left, y0 + top, width, height)
+
+def _locate_in(screen, image_path, confidence):
+    """
+    Find image_path in an already grabbed screen: the area around the previous
+    match first (GUI elements rarely move), then the whole frame.
+    """
+    key = str(image_path)
+    needle = load_template(image_path)
+    box = None
+    region = _LAST_REGIONS.get(key)
+    if region:
+        box = _match(screen, needle, confidence, region)
+    if box is None:
+        box = _match(screen, needle, confidence)
+    if box is not None:
+        _remember_region(key, box)
+    return box
+
+def locate_on_screen(image_path, confidence=0.8):
+    """
+    Find image_path on screen using its cached template and a single screen
+    grab. Returns the (left, top, width, height) box or None.
+    """
+    return _locate_in(_grab_screen(), image_path, confidence)
+
+def _remember_region(key, box):
+    """Store a padded search region around box for the template named key."""
+    left, top, width, height = box
+    x0 = max(0, left - REGION_MARGIN)
+    y0 = max(0, top - REGION_MARGIN)
+    _LAST_REGIONS[key] = (x0, y0, left - x0 + width + REGION_MARGIN,
+                          top - y0 + height + REGION_MARGIN)
+
 # -------------------------------
 # GUI click helper (safe, robust)
 def safe_click(
@@ -67,7 +162,7 @@ def safe_click(
             raise MouseInterferenceError(f"Clicking '{image_path.name}' took too long.")
 
         try:
-            box = pag.locateOnScreen(str(image_path), confidence=confidence)
+            box = locate_on_screen(image_path, confidence=confidence)
             if not box:
                 print(f"[Warning] '{image_path.name}' not found (attempt {attempt}/{retries})")
                 sleep(delay)
@@ -98,9 +193,9 @@ def safe_click(
             if post_confirm_image:
                 t0 = time()
                 while time() - t0 < post_confirm_timeout:
-                    if pag.locateOnScreen(str(post_confirm_image), confidence=confidence):
+                    if locate_on_screen(post_confirm_image, confidence=confidence):
                         return True
-                    sleep(0.2)
+                    sleep(0.1)
                 print(f"[Warning] '{post_confirm_image.name}' never appeared.")
                 return False
 
@@ -124,25 +219,72 @@ def load_combinations(file_path, n_stages):
     Returns: list of (positions_list, label_or_None)
     Skips lines that are invalid, blank, or commented (#).
     """
-    combos = []
     with open(file_path, "r") as f:
-        for line in f:
-            # Skip blank/comment lines
-            if not line.strip() or line.strip().startswith("#"):
-                continue
-            parts = [x.strip() for x in line.strip().split(",")]
-            if len(parts) < n_stages:
-                print(f"[Warning] Skipping invalid line: {line.strip()}")
-                continue
-            try:
-                positions = [float(x) for x in parts[:n_stages]]
-            except ValueError:
-                print(f"[Warning] Skipping invalid line: {line.strip()}")
-                continue
-            label = parts[n_stages] if len(parts) > n_stages else None
-            combos.append((positions, label))
+        # Skip blank/comment lines (once, for both parsers below)
+        lines = [s for s in (line.strip() for line in f) if s and s[0] != "#"]
+    if not lines:
+        return []
+    try:
+        return _parse_combinations_array(lines, n_stages)
+    except ValueError:
+        # Some line is malformed: parse line by line, warning about bad lines
+        return _parse_combinations_lines(lines, n_stages)
+
+def _parse_combinations_array(lines, n_stages):
+    """
+    Fast path of load_combinations: positions are parsed by numpy in one go.
+    Raises ValueError on any invalid line. comments=None, so numpy accepts
+    exactly the lines _parse_combinations_lines would.
+    """
+    positions = np.loadtxt(lines, delimiter=",", comments=None,
+                           usecols=range(n_stages), ndmin=2)
+    labels = []
+    for s in lines:
+        parts = s.split(",")
+        labels.append(parts[n_stages].strip() if len(parts) > n_stages else None)
+    return list(zip(positions.tolist(), labels))
+
+def _parse_combinations_lines(lines, n_stages):
+    """Slow path of load_combinations: parses (and validates) one line at a time."""
+    combos = []
+    for s in lines:
+        # float() ignores surrounding whitespace, so only the label needs stripping
+        parts = s.split(",")
+        if len(parts) < n_stages:
+            print(f"[Warning] Skipping invalid line: {s}")
+            continue
+        try:
+            positions = list(map(float, parts[:n_stages]))
+        except ValueError:
+            print(f"[Warning] Skipping invalid line: {s}")
+            continue
+        label = parts[n_stages].strip() if len(parts) > n_stages else None
+        combos.append((positions, label))
     return combos
 
+# -------------------------------
+# Manifest of the data files written by a run
+MANIFEST_NAME = "manifest.json"
+
+def save_manifest(data_dir, written_files):
+    """Record the names of the data files written so far in data_dir/manifest.json."""
+    with open(Path(data_dir) / MANIFEST_NAME, "w") as f:
+        json.dump([Path(p).name for p in written_files], f, indent=1)
+
+def load_manifest(data_dir):
+    """
+    Return the data files listed in data_dir/manifest.json, or None if the
+    folder has no manifest. Files that have since gone missing are kept, so
+    postprocessing reports them instead of silently leaving them out.
+    """
+    data_dir = Path(data_dir)
+    try:
+        with open(data_dir / MANIFEST_NAME) as f:
+            names = json.load(f)
+    except FileNotFoundError:
+        return None
+    return [data_dir / name for name in names]
+
 # -------------------------------
 # Main measurement routine
 def measurement(session: XPSMotionSession, combinations_file, iteration_time, description):
@@ -158,6 +300,10 @@ def measurement(session: XPSMotionSession, combinations_file, iteration_time, de
         combinations_file: Path to motion.txt or similar
         iteration_time: Data acquisition time per point (seconds)
         description: Description string for output directory
+
+    Returns:
+        (data_dir, written_files): the output folder (None if nothing was run)
+        and the data files completed in this run, also listed in data_dir/manifest.json.
     """
     if len(session.stages) != 4:
         raise ValueError("two_qubit_tomography_xps.py requires exactly 4 stages.")
@@ -176,12 +322,13 @@ def measurement(session: XPSMotionSession, combinations_file, iteration_time, de
     combos = load_combinations(combinations_file, n_stages)
     if not combos:
         print(f"No valid combinations found in {combinations_file}")
-        return
+        return None, []
 
     # Prepare output directory for UQD CSV files
     timestamp = datetime.now().strftime("%Y-%m-%d-%H%M%S")
-    data_dir = Path(__file__).parent / "saved_data" / f"{timestamp}_{description}"
+    data_dir = SAVED_DATA_DIR / f"{timestamp}_{description}"
     data_dir.mkdir(parents=True, exist_ok=True)
+    written_files = []
 
     # Activate UQD window
     try:
@@ -191,15 +338,26 @@ def measurement(session: XPSMotionSession, combinations_file, iteration_time, de
         sleep(1.5)
     except Exception:
         print("UQD window not found!")
-        return
+        return data_dir, written_files
 
     # Timing parameters for GUI automation (tweak as needed)
     wait_initial_move = 2
-    wait_write_filename = 5
-    wait_while_running = 0.3
+    wait_write_filename = 0.5
     wait_before_stop_collect = 1
 
-    screenshots_dir = Path(__file__).parent / "screenshots"
+    screenshots_dir = SCREENSHOTS_DIR
+    start_png = screenshots_dir / "start_data_collect.png"
+    stop_png = screenshots_dir / "stop_data_collect.png"
+    try:
+        preload_templates([
+            screenshots_dir / "csv_file_tag.png",
+            screenshots_dir / "save_file_dialog.png",
+            start_png,
+            stop_png,
+        ])
+    except FileNotFoundError as e:
+        print(f"[Error] {e}")
+        return data_dir, written_files
 
     for idx, (combo, label) in enumerate(combos, 1):
         # Clean label for filename: replace spaces, decimal points, etc.
@@ -221,26 +379,28 @@ def measurement(session: XPSMotionSession, combinations_file, iteration_time, de
         # 2. GUI: click csv_file_tag
         if not safe_click(screenshots_dir / "csv_file_tag.png", offset_x=200):
             print("Aborting: 'csv_file_tag' icon not found.")
-            return
+            return data_dir, written_files
 
         # 3. Wait for save dialog (give plenty of time)
         t0 = time()
         timeout = 15
         while time() - t0 < timeout:
             try:
-                if pag.locateOnScreen(str(screenshots_dir / "save_file_dialog.png"), confidence=0.8):
+                if locate_on_screen(screenshots_dir / "save_file_dialog.png", confidence=0.8):
                     break
             except Exception:
                 pass
-            sleep(0.5)
+            sleep(0.1)
         else:
             print("Save dialog did not appear after clicking CSV tag.")
-            return
+            return data_dir, written_files
 
-        # 4. In the filename field: select all, delete, write new file name
+        # 4. In the filename field: select all, delete, paste new file name
+        # (one paste instead of typing the full path key by key)
         pag.hotkey('ctrl', 'a')
         pag.press('delete')
-        pag.write(str(current_set))
+        pyperclip.copy(str(current_set))
+        pag.hotkey('ctrl', 'v')
         sleep(wait_write_filename)
 
         # 5. Tab + Enter to confirm save
@@ -250,45 +410,60 @@ def measurement(session: XPSMotionSession, combinations_file, iteration_time, de
         sleep(1.0)
 
         # 6. Wait for and click Start button
-        if not pag.locateOnScreen(str(screenshots_dir / "start_data_collect.png"), confidence=0.8):
+        if not locate_on_screen(start_png, confidence=0.8):
             print("Start button not visible.")
-            return
+            return data_dir, written_files
 
         if not safe_click(
-            screenshots_dir / "start_data_collect.png",
-            post_confirm_image=screenshots_dir / "stop_data_collect.png",
+            start_png,
+            post_confirm_image=stop_png,
             post_confirm_timeout=5
         ):
             print("Failed to click Start or it did not toggle to Stop.")
-            return
+            return data_dir, written_files
 
         print(f"[Info] {filename}: Data collection started.")
         sleep(0.5)
 
-        # 7. Wait for measurement (provided by user)
-        t_measure = time()
-        while time() - t_measure <= iteration_time:
-            sleep(wait_while_running)
+        # 7. Wait for measurement (provided by user); nothing to do meanwhile,
+        # so sleep once instead of polling. Step 8 confirms UQD is still running.
+        sleep(max(0.0, iteration_time))
 
         print("End of data taking.")
         sleep(wait_before_stop_collect)
 
         # 8. Wait for and click Stop button
-        if not pag.locateOnScreen(str(screenshots_dir / "stop_data_collect.png"), confidence=0.8):
+        if not locate_on_screen(stop_png, confidence=0.8):
             print("Stop button not visible. Was Start ever pressed?")
-            return
+            return data_dir, written_files
 
         if not safe_click(
-            screenshots_dir / "stop_data_collect.png",
+            stop_png,
             confidence=0.9,
-            post_confirm_image=screenshots_dir / "start_data_collect.png",
+            post_confirm_image=start_png,
             post_confirm_timeout=5
         ):
             print("Stop button clicked but Start never reappeared.")
-            return
+            return data_dir, written_files
 
         print("Stop clicked, idle state restored.")
 
+        if not current_set.is_file():
+            print(f"[Warning] '{filename}' was not saved by UQD; leaving it out of the manifest.")
+            continue
+
+        # 9. Keep a Parquet copy for fast re-reads during postprocessing
+        if process_uqd_results.pq is not None:
+            try:
+                process_uqd_results.write_parquet_copy(current_set)
+            except Exception as e:
+                print(f"[Warning] Could not write Parquet copy of '{filename}': {e}")
+
+        # Combos sharing a label overwrite the same file: list it only once
+        if current_set not in written_files:
+            written_files.append(current_set)
+        save_manifest(data_dir, written_files)
+
     # At the end: Return all stages to logical zero position 
     # (handled via library/config zero offsets)
     print("Returning all stages to their configured zero positions.")
@@ -297,6 +472,7 @@ def measurement(session: XPSMotionSession, combinations_file, iteration_time, de
     print("All stages returned to zero.")
 
     print("Measurement loop complete ✅")
+    return data_dir, written_files
 
 # -------------------------------
 if __name__ == "__main__":